@@ -11,7 +11,8 @@ kwargs = dict(
     url='',
     packages=find_packages(),
     install_requires=[
-        'pandas>=0.22',
+        'numpy',
+        'pandas>=0.24',
         'python-dateutil'
     ],
     entry_points={
@@ -2,9 +2,11 @@
 
 import os
 import datetime
+import functools
 import sys
 import re
 import argparse
+import numpy
 import pandas
 
 # columns
@@ -15,16 +17,24 @@ KEY_COLS = [
     'school_email', 
     'student_id'
 ]
+_KEY_SET = frozenset(KEY_COLS)
 
 # patterns
-PAT_TS = '(?P<timestamp>\d\d\d\d-\d\d-\d\d_\d\d\d\d)(_(?P<tz>[^.]*))?'
+PAT_TS = r'(?P<timestamp>\d\d\d\d-\d\d-\d\d_\d\d\d\d)(_(?P<tz>[^.]*))?'
 PAT_TS_STRPTIME = '%Y-%m-%d_%H%M'
-PAT_POINTS = '\((?P<pts>\d+)\)$'
+PAT_POINTS = r'\((?P<pts>\d+)\)$'
+
+# compiled patterns (matched against every column name)
+_RE_TS = re.compile(PAT_TS)
+_RE_POINTS = re.compile(PAT_POINTS)
 
 # default file names
 OUTPUT_GRADES = 'grades.csv'
 OUTPUT_GRADES_FULL = 'grades_by_day.csv'
 
+# write buffer size for output files
+OUTPUT_BUFSIZE = 2 ** 20
+
 
 def find(seq, pattern, matcher=re.match):
     """
@@ -36,74 +46,74 @@ def find(seq, pattern, matcher=re.match):
             return elem
 
 
-def droptotals(df):
+def normalizecolumns(df):
+    """
+    Make column names lower case, with underscores instead of spaces.
+    Columns are renamed in place.
+    """
+    df.columns = df.columns.str.lower().str.replace(" ", "_", regex=False)
+    return df
+
+
+def isreportcol(col):
     """
-    drop all "total" columns
+    Column filter for report files: skip all "total" columns while parsing.
     """
-    idx = df.columns.str.contains("total")
-    df = df.copy()
-    return df.loc[:, ~idx]
+    return "total" not in col.lower()
 
 
-def dropmisc(df):
+def isassignmentcol(col):
     """
-    drop additional misc columns:
+    Column filter for assignment files: skip all "total" columns and misc
+    columns while parsing:
         * points_earned_(out_of_XX)
         * percent_grade
     """
-    to_drop = []
-    # drop "points_earned_(out_of_XX)"
-    col = find(df.columns, '^points_earned')
-    to_drop.append(col)
-    # drop "percent_grade"
-    col = find(df.columns, '^percent_grade')
-    to_drop.append(col)
-    df = df.copy()
-    return df.drop(to_drop, axis=1, errors="ignore")
+    col = col.lower().replace(" ", "_")
+    return (isreportcol(col)
+            and not col.startswith(('points_earned', 'percent_grade')))
 
 
 def readassignment(path):
     """
     Read data frame with assignment report.
     """
-    df = (pandas.read_csv(path)
-          .rename(columns=str.lower)
-          .rename(columns=lambda k: k.replace(" ", "_"))
-          .assign(due_date=lambda k: k['due_date'].apply(pandas.Timestamp))
+    df = (pandas.read_csv(path, usecols=isassignmentcol)
+          .pipe(normalizecolumns)
           .assign(due_date=lambda k: \
-                  k['due_date'].dt.tz_convert(datetime.timezone.utc))
-          .pipe(droptotals)
-          .pipe(dropmisc)
+                  pandas.to_datetime(k['due_date'], utc=True))
           .pipe(topoints)
           .pipe(fillnasafe)
           )
     return df
 
 
+def _pointscols(df):
+    """
+    Return names of all points columns (ending in "(X)") in data frame
+    """
+    return [col for col in df.columns if _RE_POINTS.search(col)]
+
+
+@functools.lru_cache(maxsize=None)
 def matchpointstotal(s):
     """ Return X (as an int) from string like "total_(X)" """
-    m = re.search(PAT_POINTS, s)
+    m = _RE_POINTS.search(s)
     pts = m.groupdict()['pts']
     pts = int(pts)
     return pts
 
 
-def _topoints(s):
-    """
-    Convert series with percentage grades back to points
-    """
-    pts = matchpointstotal(s.name)
-    return (pts * s / 100).round()
-
-
 def topoints(df):
     """
-    Convert all columns with percentages in data frame back to points
+    Convert all columns with percentages in data frame back to points.
+    Columns are updated in place.
     """
-    df = df.copy()
-    for col in df.columns:
-        if re.search(PAT_POINTS, col):
-            df[col] = _topoints(df[col])
+    pts_col = _pointscols(df)
+    pts = numpy.array([matchpointstotal(col) for col in pts_col],
+                      dtype=numpy.float64)
+    pct = df[pts_col].to_numpy(dtype=numpy.float64)
+    df[pts_col] = numpy.round(pts * pct / 100)
     return df
 
 
@@ -111,19 +121,18 @@ def fillnasafe(df):
     """
     Fill missing values making sure not to mix strings and numbers 
     """
-    fv = dict.fromkeys(df.columns, 0)
-    for col in KEY_COLS:
-        fv[col] = ''
-    df = df.copy()
-    df = df.fillna(fv)
-    return df
+    na_col = df.columns[df.isna().any(axis=0).to_numpy()]
+    if len(na_col) == 0:
+        return df
+    fv = {col: ('' if col in _KEY_SET else 0) for col in na_col}
+    return df.fillna(fv)
 
 
 def matchdatefromfilename(s):
     """
     Extract the date of the report file from zybooks from its filename
     """
-    m = re.search(PAT_TS, s)
+    m = _RE_TS.search(s)
     if m is None:
         print("Error: not a valid grade file: {}".format(s),
                 file=sys.stderr)
@@ -141,15 +150,15 @@ def matchdatefromfilename(s):
     return ts
 
 
-def readonereport(fp):
+def readonereport(fp, report_date=None):
     """
-    Read data frame with points report. Add report date as a column.
+    Read data frame with points report. Add report date as a column (parsed
+    from the file name, unless given).
     """
-    report_date = matchdatefromfilename(getattr(fp, 'name', fp))
-    df = (pandas.read_csv(fp)
-          .rename(columns=str.lower)
-          .rename(columns=lambda k: k.replace(" ", "_"))
-          .pipe(droptotals)
+    if report_date is None:
+        report_date = matchdatefromfilename(getattr(fp, 'name', fp))
+    df = (pandas.read_csv(fp, usecols=isreportcol)
+          .pipe(normalizecolumns)
           .pipe(topoints)
           .pipe(fillnasafe)
           .assign(day=report_date)
@@ -159,41 +168,51 @@ def readonereport(fp):
 
 def readmanyreports(*fp_seq):
     """
-    Read and combine all report data into a single data frame.
+    Read and combine all report data into a single data frame, in
+    chronological order.
     """
-    tmp = []
-    for fp in fp_seq:
-        df = readonereport(fp)
-        tmp.append(df)
-    df = (pandas.concat(tmp)
-          .set_index('day')
-          .sort_index(axis=0)
-          .reset_index())
+    dated = [(matchdatefromfilename(getattr(fp, 'name', fp)), fp)
+             for fp in fp_seq]
+    dated.sort(key=lambda k: k[0])
+    df = pandas.concat((readonereport(fp, report_date=ts) for ts, fp in dated),
+                       ignore_index=True)
     return df
-        
+
 
 def dropwithsuffix(df, suffix):
     """
     Drop all columns whose name ends with given suffix
     """
-    idx = df.columns.str.endswith(suffix)
-    df = df.copy()
-    return df.loc[:, ~idx]
+    col_to_keep = [col for col in df.columns if not col.endswith(suffix)]
+    return df.loc[:, col_to_keep]
 
 
 def dropextrapoints(df, df_hw):
     """
-    Drop points columns that are not in assignment
+    Drop points columns that are not in assignment. Columns are dropped in
+    place.
     """
-    pts_col_df = df.filter(regex=PAT_POINTS, axis=1).columns
-    pts_col_hw = df_hw.filter(regex=PAT_POINTS, axis=1).columns
-    col_to_keep = pts_col_df.intersection(pts_col_hw)
-    col_to_drop = pts_col_df.difference(col_to_keep)
-    df = df.copy()
-    df = df.drop(col_to_drop, axis=1, errors='ignore')
+    pts_col_hw = set(_pointscols(df_hw))
+    col_to_drop = [col for col in _pointscols(df) if col not in pts_col_hw]
+    df.drop(col_to_drop, axis=1, errors='ignore', inplace=True)
     return df
 
 
+def diffbykey(df):
+    """
+    Replace numeric columns with their increment from the previous row with
+    the same index (first row of each index is left unchanged). Data frame
+    must be sorted by index. Columns are updated in place.
+    """
+    num_col = df.select_dtypes('number').columns
+    arr = df[num_col].to_numpy(dtype=numpy.float64)
+    diff = arr.copy()
+    diff[1:] -= arr[:-1]
+    is_first = ~df.index.duplicated(keep='first')
+    keep = is_first[:, None] | numpy.isnan(diff)
+    df[num_col] = numpy.where(keep, arr, diff)
+    return df
+
 
 def read(*fp_seq, assignment_fp=None):
     """
@@ -215,25 +234,19 @@ def read(*fp_seq, assignment_fp=None):
             .sort_index())
         # compute point increments and late days
         df = (df
-              .groupby(by=df.index.names)
-              .diff()
-              .fillna(df)
-              .assign(due_date=df['due_date'])
-              .assign(day=df['day'])
+              .pipe(diffbykey)
               .assign(days_late=(df['day'] - df['due_date']).astype('m8[D]'))
               .reset_index())
     else:
         # compute point increments only
-        df = df.set_index(KEY_COLS).sort_index()
         df = (df
-              .groupby(by=df.index.names)
-              .diff()
-              .fillna(df)
-              .assign(day=df['day'])
+              .set_index(KEY_COLS)
+              .sort_index()
+              .pipe(diffbykey)
               .reset_index())
     # compute point total
-    pts_col = df.filter(regex=PAT_POINTS, axis=1).columns
-    pts_tot = int(df.columns.str.extractall(PAT_POINTS).astype(int).sum())
+    pts_col = _pointscols(df)
+    pts_tot = sum(matchpointstotal(col) for col in pts_col)
     name = 'total_({:d})'.format(pts_tot)
     df[name] = df[pts_col].sum(axis=1)
     return df
@@ -241,13 +254,16 @@ def read(*fp_seq, assignment_fp=None):
 
 def deductpoints(df, penalty):
     """
-    Deduct points earned on late days
+    Deduct points earned on late days. Points columns are updated in place.
     """
-    df = df.copy()
     pen = penalty / 100
-    for col in df.columns:
-        if re.search(PAT_POINTS, col):
-            df[col] -= df['days_late'].clip(0) * pen * df[col]
+    pts_col = _pointscols(df)
+    days_late = df['days_late'].to_numpy(dtype=numpy.float64)
+    late = numpy.clip(days_late, 0, None) * pen
+    pts = df[pts_col].to_numpy(dtype=numpy.float64, copy=True)
+    # same evaluation order as `col -= days_late * pen * col`
+    pts -= late[:, None] * pts
+    df[pts_col] = pts
     return df
 
 
@@ -255,7 +271,6 @@ def finalgrade(df, threshold):
     """
     Compute final grade based on threshold.
     """
-    df = df.copy()
     total_col = find(df.columns, 'total_')
     total_pts = matchpointstotal(total_col)
     df = (df
@@ -264,14 +279,16 @@ def finalgrade(df, threshold):
           .sum()
           .reset_index())
     df['total'] = df[total_col] / total_pts * 100
-    df['final'] = df.apply(scorefun, axis=1, args=(threshold,))
+    df['final'] = scorearray(df['total'].to_numpy(dtype=numpy.float64),
+                             threshold)
     df['final_pts'] = df['final'] / 100 * total_pts
     return df
 
 
 def scorefun(x, threshold=70):
     """
-    Score function used by `finalgrade`
+    Score function for a single row. `finalgrade` applies the same rule
+    to all rows at once.
     """
     if x['total'] >= threshold:
         return 100
@@ -279,6 +296,18 @@ def scorefun(x, threshold=70):
         return x['total']
 
 
+def scorearray(total, threshold=70):
+    """
+    Score function used by `finalgrade`. Same rule as `scorefun`, applied
+    to an array of totals.
+    """
+    full = total >= threshold
+    if full.all():
+        # integer grades, as when applying `scorefun` row by row
+        return numpy.full(total.shape, 100)
+    return numpy.where(full, 100.0, total)
+
+
 def summarize(df):
     """
     Compute summary of points earned by day
@@ -332,14 +361,14 @@ def makeparser():
                         help="Deduct points earned late (default: -%(default)d%%/day) ")
     parser.add_argument("-o", 
                         "--output",
-                        type=argparse.FileType('w'),
+                        type=argparse.FileType('w', bufsize=OUTPUT_BUFSIZE),
                         metavar="PATH",
                         default=OUTPUT_GRADES,
                         help="Write results to path (default: %(default)s)")
     parser.add_argument("-O",
                         "--output-summary",
                         metavar="PATH",
-                        type=argparse.FileType('w'),
+                        type=argparse.FileType('w', bufsize=OUTPUT_BUFSIZE),
                         default=OUTPUT_GRADES_FULL,
                         help="Write daily point summary to path"
                         " (default: %(default)s")